@@ -1,4 +1,5 @@
 import logging
+from typing import Any, Dict
 from fastapi import APIRouter, Request, Depends, HTTPException
 from app.core.state import vertex_rotator, gemini_rotator
 from app.security.auth import auth_manager, get_current_admin
@@ -9,7 +10,7 @@ router = APIRouter(prefix="/admin", tags=["Admin"])
 
 
 @router.post("/login")
-async def admin_login(request: Request):
+async def admin_login(request: Request) -> Dict[str, Any]:
     """Вход в админ-панель"""
     try:
         data = await request.json()
@@ -22,7 +23,7 @@ async def admin_login(request: Request):
                 status_code=400, detail="Username and password required"
             )
 
-        token = auth_manager.authenticate_admin(username, password, client_ip)
+        token = await auth_manager.authenticate_admin(username, password, client_ip)
         return {"access_token": token, "token_type": "bearer"}
 
     except HTTPException:
@@ -35,7 +36,7 @@ async def admin_login(request: Request):
 @router.post("/reload")
 async def admin_reload(
     request: Request, current_admin: dict = Depends(get_current_admin)
-):
+) -> Dict[str, Any]:
     """Горячая перезагрузка ключей без остановки сервиса"""
     try:
         vertex_rotator.reload()
@@ -55,7 +56,9 @@ async def admin_reload(
 
 
 @router.get("/status")
-async def admin_status(current_admin: dict = Depends(get_current_admin)):
+async def admin_status(
+    current_admin: dict = Depends(get_current_admin),
+) -> Dict[str, Any]:
     """Статус системы"""
     try:
         from app.security.audit import security_auditor
@@ -75,7 +78,10 @@ async def admin_status(current_admin: dict = Depends(get_current_admin)):
 
 
 @router.get("/stats")
-async def get_system_stats(current_admin: dict = Depends(get_current_admin)):
+async def get_system_stats(
+    current_admin: dict = Depends(get_current_admin),
+) -> Dict[str, Any]:
     """Детальная статистика использования"""
+    # Тип возврата задан: FastAPI сериализует ответ через Pydantic сразу в JSON
     return await stats_service.get_stats()
 
@@ -1,28 +1,32 @@
-import re
 import asyncio
 import logging
+import random
 import time
-from fastapi import APIRouter, Request, Response, HTTPException, status
+import httpx
+from functools import lru_cache
+from typing import AsyncIterator
+from fastapi import APIRouter, Depends, Request, Response, HTTPException, status
 from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
 from app.config import settings
 from app.core import state
 from app.services.statistics import stats_service
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
 
-# Регулярка для подмены Project ID в Vertex
-# Поддерживает v1, v1beta1, v2 и т.д.
-PROJECT_PATH_REGEX = re.compile(r"(v1(?:beta\d+)?/projects/)([^/]+)(/locations.*)")
 
-@router.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
-async def proxy_gateway(request: Request, path: str):
+async def check_client_ip(request: Request):
+    """
+    Зависимость: пускает к прокси только IP из белого списка.
+    Проверка выполняется после роутинга, поэтому ее обходят лишь запросы,
+    реально попавшие в роуты админки или документации, а не любой путь
+    с похожим префиксом.
+    """
+    security = settings.security
+    if security.allow_all_client_ips:
+        return
     client_ip = getattr(request.client, "host", "unknown")
-
-    # Проверка IP-адреса по белому списку
-    if settings.security.allowed_client_ips and settings.security.allowed_client_ips == ["*"]:
-        pass
-    elif settings.security.allowed_client_ips and client_ip not in settings.security.allowed_client_ips:
+    if client_ip not in security.allowed_client_ips_set:
         logger.warning(f"Unauthorized access attempt from IP: {client_ip}")
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -30,33 +34,206 @@ async def proxy_gateway(request: Request, path: str):
         )
 
 
-    # 1. Определяем провайдера по URL
+router = APIRouter(dependencies=[Depends(check_client_ip)])
+
+# Заголовки клиента, которые не пробрасываются апстриму.
+# Hop-by-hop заголовки запрещены в HTTP/2 и к апстриму не относятся.
+# Content-Length сохраняем: с ним httpx не переводит потоковое тело в chunked.
+# Starlette хранит имена в raw уже в нижнем регистре
+_DROP_REQUEST_HEADERS = frozenset((
+    b"host", b"authorization", b"x-goog-api-key",
+    b"connection", b"keep-alive", b"proxy-connection", b"te", b"upgrade",
+    b"transfer-encoding",
+))
+
+# Заголовки ответа, которые теряют смысл после перепаковки тела
+_STRIP_RESPONSE_HEADERS = frozenset(
+    (b"content-encoding", b"content-length", b"transfer-encoding")
+)
+# При отдаче тела как есть кодировка и длина остаются верными
+_STRIP_RAW_RESPONSE_HEADERS = frozenset((b"transfer-encoding",))
+
+# Сколько байт тела ошибки провайдера читаем для лога перед повтором
+_ERROR_BODY_PEEK = 512
+
+# Сколько байт тела запроса держим в памяти ради повторных попыток.
+# Тело больше лимита уходит апстриму потоком без копии и не повторяется
+_REPLAY_BUFFER_LIMIT = 16 * 1024 * 1024
+
+
+class _ReplayableBody:
+    """
+    Тело запроса, которое уходит апстриму потоком по мере чтения от клиента.
+    Поток клиента читается только один раз, поэтому прочитанные чанки
+    запоминаются: повторная попытка отправит их заново и дочитает остаток.
+    Копия держится, пока тело не превысит limit; дальше чанки только
+    пробрасываются, а replayable становится False.
+    """
+
+    def __init__(self, stream: AsyncIterator[bytes], limit: int):
+        self._stream = stream
+        self._chunks: list[bytes] = []
+        self._size = 0
+        self._limit = limit
+        self._exhausted = False
+        self.replayable = True
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if not self.replayable:
+            raise RuntimeError("Request body exceeded the replay buffer")
+        for chunk in self._chunks:
+            yield chunk
+        if self._exhausted:
+            return
+        async for chunk in self._stream:
+            if self.replayable:
+                self._size += len(chunk)
+                if self._size > self._limit:
+                    self._chunks.clear()
+                    self.replayable = False
+                else:
+                    self._chunks.append(chunk)
+            yield chunk
+        self._exhausted = True
+
+
+def _can_replay(body: "bytes | _ReplayableBody") -> bool:
+    """Можно ли отправить тело запроса еще раз для следующей попытки."""
+    return not isinstance(body, _ReplayableBody) or body.replayable
+
+
+def _retry_delay(attempt: int) -> float:
+    """
+    Пауза перед повтором после сетевой ошибки: экспонента с джиттером,
+    чтобы параллельные запросы не ретраили синхронно.
+    """
+    return min(0.05 * (2 ** (attempt - 1)), 2.0) * random.uniform(0.5, 1.5)
+
+
+def _clean_upstream_headers(
+    headers: httpx.Headers, strip: frozenset[bytes]
+) -> list[tuple[bytes, bytes]]:
+    """
+    Готовит заголовки апстрима для ответа клиенту в сыром виде ASGI.
+    Байты не декодируются и не кодируются обратно, а повторяющиеся
+    заголовки (например, Set-Cookie) не схлопываются, как в dict.
+    """
+    return [
+        (name, value)
+        for key, value in headers.raw
+        if (name := key.lower()) not in strip
+    ]
+
+
+@lru_cache(maxsize=4096)
+def _extract_model(path: str, is_gemini: bool) -> str:
+    """
+    Извлекает модель из URL для статистики.
+    Gemini: models/gemini-pro:generateContent -> gemini-pro
+    Vertex: locations/us-central1/publishers/google/models/gemini-pro
+    Набор путей ограничен, поэтому результат кэшируется.
+    Нужный сегмент ищется через find, без разбиения всего пути на части.
+    """
+    if path.startswith("models/"):
+        start = 7
+    else:
+        start = path.find("/models/")
+        if start < 0:
+            return "unknown"
+        start += 8
+
+    end = path.find("/", start)
+    model = path[start:] if end < 0 else path[start:end]
+    return model.split(":", 1)[0] if is_gemini else model
+
+
+def _rewrite_project(path: str, project_id: str) -> str:
+    """
+    Подменяет Project ID в пути Vertex вида v1[betaN]/projects/<id>/locations...
+    Разбор строковыми операциями вместо регулярки; пути другого вида
+    возвращаются без изменений.
+    """
+    version, sep, rest = path.partition("/projects/")
+    if not sep or not (
+        version == "v1"
+        or (version.startswith("v1beta") and version[6:].isdigit())
+    ):
+        return path
+
+    end = rest.find("/")
+    if end <= 0 or not rest.startswith("/locations", end):
+        return path
+    return f"{version}/projects/{project_id}{rest[end:]}"
+
+
+@router.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
+async def proxy_gateway(request: Request, path: str):
+    # 1. Определяем провайдера и модель по URL
     is_gemini = "projects/" not in path
+    model = _extract_model(path, is_gemini)
+
+    # Клиент создается в lifespan; берем его один раз на весь запрос
+    client = state.http_client
+    if client is None:
+        raise HTTPException(status_code=503, detail="Service is not ready")
+
+    # Настройки, нужные в цикле попыток, читаем один раз
+    services = settings.services
+    max_retries = services.max_retries
+
+    # Тело не буферизуем целиком: апстрим начинает получать его сразу.
+    # Без повторов копия не нужна вовсе.
+    # Запрос без тела (обычно GET) отправляем пустым, чтобы не было chunked
+    if "content-length" in request.headers or "transfer-encoding" in request.headers:
+        body = _ReplayableBody(
+            request.stream(), _REPLAY_BUFFER_LIMIT if max_retries > 1 else 0
+        )
+    else:
+        body = b""
 
-    body = await request.body()
+    # Заголовки: копируем без служебных за один проход по сырым парам
+    headers = {
+        k.decode("latin-1"): v.decode("latin-1")
+        for k, v in request.headers.raw
+        if k not in _DROP_REQUEST_HEADERS
+    }
 
-    # Заголовки: копируем и чистим
-    headers = dict(request.headers)
-    for h in ["host", "content-length", "authorization", "x-goog-api-key"]:
-        headers.pop(h, None)
+    # Клиент, приславший Accept-Encoding, сам распакует ответ: отдаем ему
+    # байты апстрима без распаковки и повторной упаковки
+    raw_passthrough = "accept-encoding" in request.headers
+    if raw_passthrough:
+        strip_response_headers = _STRIP_RAW_RESPONSE_HEADERS
+    else:
+        strip_response_headers = _STRIP_RESPONSE_HEADERS
+
+    # Параметры запроса разбираем один раз на все попытки.
+    # Список пар сохраняет повторяющиеся параметры, в отличие от dict
+    query_params = request.query_params.multi_items()
+    if is_gemini:
+        gemini_params = [item for item in query_params if item[0] != "key"]
+
+    if is_gemini:
+        provider = "gemini"
+        upstream_base = services.gemini_base_url
+    else:
+        provider = "vertex"
+        upstream_base = services.vertex_base_url
 
     attempts = 0
-    while attempts < settings.services.max_retries:
+    while attempts < max_retries:
         attempts += 1
-        start_time = time.time()
+        # Монотонные часы не прыгают при подстройке системного времени
+        start_ns = time.monotonic_ns()
         key_id = "unknown"
-        provider = "gemini" if is_gemini else "vertex"
-        model = "unknown"
 
         try:
             if is_gemini:
-                upstream_base = settings.services.gemini_base_url
                 target_path = path
 
                 api_key = state.gemini_rotator.get_next_key()
                 if not api_key:
-                    latency = time.time() - start_time
-                    await stats_service.record_request(
+                    latency = (time.monotonic_ns() - start_ns) / 1e9
+                    stats_service.enqueue(
                         provider=provider,
                         model=model,
                         key_id="system", # Нет ключа
@@ -65,67 +242,49 @@ async def proxy_gateway(request: Request, path: str):
                     )
                     return Response("No Gemini keys available", status_code=503)
 
-                params = dict(request.query_params)
-                params["key"] = api_key
+                # Клиентский key всегда заменяется ключом из ротатора
+                params = gemini_params + [("key", api_key)]
                 key_id = api_key  # Для статистики
-                log_auth = f"Key ...{api_key[-4:]}"
-                
-                # Пытаемся извлечь модель из URL (например, models/gemini-pro:generateContent)
-                parts = path.split("/")
-                if "models" in parts:
-                    try:
-                        idx = parts.index("models") + 1
-                        if idx < len(parts):
-                            model = parts[idx].split(":")[0]
-                    except:
-                        pass
+                log_auth = ("Key ...", api_key[-4:])
 
             else:
-                upstream_base = settings.services.vertex_base_url
-                cred = state.vertex_rotator.get_next_credential()
+                try:
+                    cred = state.vertex_rotator.get_next_credential()
+                except RuntimeError:
+                    # Пустой пул не наполнится между попытками - ретраи бессмысленны
+                    latency = (time.monotonic_ns() - start_ns) / 1e9
+                    stats_service.enqueue(
+                        provider=provider,
+                        model=model,
+                        key_id="system", # Нет учетных данных
+                        status_code=503,
+                        latency=latency
+                    )
+                    return Response("No Vertex credentials available", status_code=503)
                 token = await state.vertex_rotator.get_token(cred)
 
-                match = PROJECT_PATH_REGEX.match(path)
-                target_path = (
-                    f"{match.group(1)}{cred.project_id}{match.group(3)}"
-                    if match
-                    else path
-                )
+                target_path = _rewrite_project(path, cred.project_id)
 
                 headers["Authorization"] = f"Bearer {token}"
                 headers["X-Goog-User-Project"] = cred.project_id
-                params = dict(request.query_params)
+                params = query_params
                 key_id = cred.project_id # Для статистики
-                log_auth = f"Project {cred.project_id}"
-                
-                # Пытаемся извлечь модель из URL
-                # locations/us-central1/publishers/google/models/gemini-pro
-                parts = path.split("/")
-                if "models" in parts:
-                    try:
-                        idx = parts.index("models") + 1
-                        if idx < len(parts):
-                            model = parts[idx]
-                    except:
-                        pass
+                log_auth = ("Project ", cred.project_id)
 
 
             url = f"{upstream_base}/{target_path}"
-            logger.info(f"Attempt {attempts} [{log_auth}] -> {url}")
-
-            if state.http_client is None:
-                raise HTTPException(status_code=503, detail="Service is not ready")
+            # Ленивое форматирование: строка не собирается, если INFO выключен
+            logger.info("Attempt %d [%s%s] -> %s", attempts, *log_auth, url)
 
-
-            req = state.http_client.build_request(
+            req = client.build_request(
                 request.method, url, content=body, headers=headers, params=params
             )
-            resp = await state.http_client.send(req, stream=True)
+            resp = await client.send(req, stream=True)
             
             # Записываем статистику УСПЕШНОГО (с точки зрения сети) запроса
             # Даже если там 4xx или 5xx от провайдера
-            latency = time.time() - start_time
-            await stats_service.record_request(
+            latency = (time.monotonic_ns() - start_ns) / 1e9
+            stats_service.enqueue(
                 provider=provider,
                 model=model,
                 key_id=key_id,
@@ -133,34 +292,44 @@ async def proxy_gateway(request: Request, path: str):
                 latency=latency
             )
 
-            if resp.status_code in [429, 403, 503]:
-                err_body = await resp.aread()
-                logger.warning(f"Provider Error {resp.status_code}: {err_body[:200]}")
+            # Тело, не влезшее в буфер, повторить нельзя: отдаем ошибку как есть
+            if resp.status_code in [429, 403, 503] and _can_replay(body):
+                # Для лога хватает начала тела: дочитывать большой ответ незачем
+                err_body = bytearray()
+                async for chunk in resp.aiter_bytes():
+                    err_body += chunk
+                    if len(err_body) >= _ERROR_BODY_PEEK:
+                        break
+                await resp.aclose()
+                logger.warning("Provider Error %d: %s", resp.status_code, bytes(err_body[:200]))
                 continue
 
-            return StreamingResponse(
-                resp.aiter_bytes(),
+            response = StreamingResponse(
+                resp.aiter_raw() if raw_passthrough else resp.aiter_bytes(),
                 status_code=resp.status_code,
-                headers={
-                    k: v
-                    for k, v in resp.headers.items()
-                    if k.lower()
-                    not in ("content-encoding", "content-length", "transfer-encoding")
-                },
             )
+            response.raw_headers = _clean_upstream_headers(
+                resp.headers, strip_response_headers
+            )
+            return response
 
+        except ClientDisconnect:
+            # Клиент оборвал загрузку тела - повторять запрос бессмысленно
+            raise
         except Exception as e:
-            latency = time.time() - start_time
-            logger.error(f"Proxy error: {e}")
+            latency = (time.monotonic_ns() - start_ns) / 1e9
+            logger.error("Proxy error: %s", e)
             # Записываем ошибку сети (например, 500 internal app error или connection error)
-            await stats_service.record_request(
+            stats_service.enqueue(
                 provider=provider,
                 model=model,
                 key_id=key_id,
                 status_code=500,
                 latency=latency
             )
-            await asyncio.sleep(0.5)
+            if not _can_replay(body):
+                break
+            await asyncio.sleep(_retry_delay(attempts))
             continue
 
     return Response("All backends exhausted or unavailable", status_code=503)
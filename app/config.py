@@ -6,7 +6,8 @@ variables and/or a .env file. It provides a structured, type-hinted, and
 validated way to access configuration.
 """
 import logging
-from functools import lru_cache
+import os
+from functools import cached_property, lru_cache
 from pathlib import Path
 from typing import List, Set, Optional
 
@@ -48,6 +49,12 @@ class ServiceSettings(BaseSettings):
     gemini_base_url: str = "https://generativelanguage.googleapis.com"
     max_retries: int = 10
     redis_url: str = "redis://redis:6379/0"
+    # How long (seconds) /admin/stats serves cached aggregates.
+    stats_cache_ttl: float = 10.0
+    # Connection pool of the shared upstream HTTP/2 client.
+    http_max_connections: int = 500
+    http_max_keepalive_connections: int = 200
+    http_keepalive_expiry: float = 60.0
 
 
 class SecuritySettings(BaseSettings):
@@ -63,6 +70,17 @@ class SecuritySettings(BaseSettings):
         if self.allowed_client_ips == ["*"]:
             logger.warning("ALLOWED_CLIENT_IPS is set to *. Proxy endpoints will be accessible to all IPs.")
 
+    @cached_property
+    def allow_all_client_ips(self) -> bool:
+        """True if the allowlist is empty or set to *."""
+        return not self.allowed_client_ips or self.allowed_client_ips == ["*"]
+
+    @cached_property
+    def allowed_client_ips_set(self) -> frozenset[str]:
+        """The allowlist as a frozenset for O(1) membership checks."""
+        return frozenset(self.allowed_client_ips)
+
+
 class Settings(BaseSettings):
     """Main settings aggregator."""
     model_config = SettingsConfigDict(
@@ -103,24 +121,32 @@ def ensure_directories():
     ]
     
     for dir_path in dirs_to_create:
+        # Create directly instead of stat-ing first; an existing one is the common case
         try:
-            if not dir_path.exists():
-                dir_path.mkdir(parents=True, exist_ok=True)
-                logger.info(f"Created directory: {dir_path}")
+            dir_path.mkdir(parents=True)
+            logger.info(f"Created directory: {dir_path}")
+        except FileExistsError:
+            pass
         except OSError as e:
             logger.error(f"Failed to create directory {dir_path}: {e}")
             raise
             
-    # Create an empty template for Gemini keys if the file doesn't exist
+    # Create an empty template for Gemini keys if the file doesn't exist.
+    # O_EXCL makes the existence check and the create a single atomic open
     gemini_keys_file = settings.paths.gemini_keys_file
-    if not gemini_keys_file.exists():
-        try:
-            with open(gemini_keys_file, "w") as f:
-                f.write("[]")  # Empty JSON list
-            logger.warning(f"Created empty template for Gemini keys: {gemini_keys_file}")
-        except IOError as e:
-            logger.error(f"Failed to create Gemini keys template {gemini_keys_file}: {e}")
-            raise
+    try:
+        fd = os.open(gemini_keys_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return
+    except OSError as e:
+        logger.error(f"Failed to create Gemini keys template {gemini_keys_file}: {e}")
+        raise
+
+    try:
+        os.write(fd, b"[]")  # Empty JSON list
+    finally:
+        os.close(fd)
+    logger.warning(f"Created empty template for Gemini keys: {gemini_keys_file}")
 
 # --- Expose a single settings instance for convenience ---
 settings = get_settings()
\ No newline at end of file
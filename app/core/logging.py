@@ -14,13 +14,20 @@ def setup_logging():
     
     # Формат логов: ЦВЕТ | ВРЕМЯ | УРОВЕНЬ | ИМЯ | СООБЩЕНИЕ
     # Исправлен формат даты: %m вместо %м
-    formatter = colorlog.ColoredFormatter(
-        "%(log_color)s%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-        log_colors=log_colors,
-        reset=True,
-        style='%'
-    )
+    if sys.stdout.isatty():
+        formatter = colorlog.ColoredFormatter(
+            "%(log_color)s%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+            log_colors=log_colors,
+            reset=True,
+            style='%'
+        )
+    else:
+        # Docker и файлы логов: ANSI-коды там не нужны и только тратят время
+        formatter = logging.Formatter(
+            "%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
 
     # Используем stdout, чтобы Docker корректно ловил логи
     handler = logging.StreamHandler(stream=sys.stdout)
@@ -34,9 +41,8 @@ def setup_logging():
     root_logger.handlers = []
     root_logger.addHandler(handler)
 
-    # Перехватываем логгеры Uvicorn для единого стиля
+    # Логгеры Uvicorn пишут через общий хендлер root для единого стиля
     for logger_name in ["uvicorn", "uvicorn.access", "uvicorn.error"]:
         logger = logging.getLogger(logger_name)
         logger.handlers = [] # Удаляем дефолтные хендлеры uvicorn
-        logger.addHandler(handler)
-        logger.propagate = False # Чтобы не дублировалось в root
+        logger.propagate = True # Без своих хендлеров дублей не будет
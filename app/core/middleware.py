@@ -1,49 +1,52 @@
 import time
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+from app.api.proxy import _extract_model
 from app.services.statistics import stats_service
 
-class StatsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        if request.url.path.startswith("/admin") or request.url.path == "/health":
-            return await call_next(request)
+# Пути, которые не попадают в статистику
+_STATS_SKIP_PATHS = frozenset(("/health",))
+_STATS_SKIP_PREFIXES = ("/admin",)
+
+
+class StatsMiddleware:
+    """
+    Считает статистику по запросам к прокси.
+    Чистый ASGI-middleware: статус берется из события http.response.start,
+    без task group и потока памяти, которые создает BaseHTTPMiddleware.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        if path in _STATS_SKIP_PATHS or path.startswith(_STATS_SKIP_PREFIXES):
+            return await self.app(scope, receive, send)
+
+        start_ns = time.perf_counter_ns()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
 
-        start_time = time.time()
-        
         # Выполнение запроса
         try:
-            response = await call_next(request)
-            status_code = response.status_code
-        except Exception:
-            status_code = 500
-            raise
+            await self.app(scope, receive, send_wrapper)
         finally:
-            process_time = time.time() - start_time
-            
-            # Определяем провайдера и модель (упрощенная логика)
-            path = request.url.path
-            if "projects/" in path:
-                provider = "vertex"
-                # Пытаемся вытащить модель из пути, например /publishers/google/models/gemini-1.5-pro
-                parts = path.split("/")
-                try:
-                    model_idx = parts.index("models") + 1
-                    model = parts[model_idx]
-                except (ValueError, IndexError):
-                    model = "unknown"
-            else:
-                provider = "gemini"
-                # Обычно /v1beta/models/gemini-pro:generateContent
-                parts = path.split("/")
-                try:
-                    model_idx = parts.index("models") + 1
-                    # Может быть 'gemini-pro:generateContent', берем до двоеточия
-                    model = parts[model_idx].split(":")[0]
-                except (ValueError, IndexError):
-                    model = "unknown"
-
-            # Асинхронно обновляем статистику (не блокируем ответ клиенту)
-            # В реальном хайлоаде лучше использовать background task, но здесь ок
-            await stats_service.record_request(provider, model, status_code, process_time)
-
-        return response
+            # Статистика хранит задержку в секундах
+            process_time = (time.perf_counter_ns() - start_ns) / 1e9
+
+            # Модель разбирается так же, как в самом прокси
+            is_gemini = "projects/" not in path
+            provider = "gemini" if is_gemini else "vertex"
+            model = _extract_model(path.lstrip("/"), is_gemini)
+
+            # Ставим запись в очередь фоновой пакетной записи, не ожидая Redis.
+            # Ключ апстрима middleware не знает
+            stats_service.enqueue(provider, model, "unknown", status_code, process_time)
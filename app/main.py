@@ -4,11 +4,12 @@ import httpx
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 
-from app.config import ensure_directories
+from app.config import ensure_directories, settings
 from app.core.logging import setup_logging
 from app.core import state
 from app.api import admin, proxy
 from app.core.middleware import StatsMiddleware
+from app.services.statistics import stats_service
 
 # --- LOGGING ---
 setup_logging()
@@ -25,12 +26,24 @@ async def lifespan(app: FastAPI):
     """
     ensure_directories()
     
+    # HTTP/2 мультиплексирует запросы к Google поверх нескольких долгоживущих
+    # соединений, вместо TLS-рукопожатия на каждый новый коннект.
+    # Параметры передаются в сам клиент, а не через transport=, иначе httpx
+    # перестает учитывать HTTP(S)_PROXY из окружения
     state.http_client = httpx.AsyncClient(
-        timeout=120.0, limits=httpx.Limits(max_keepalive_connections=50)
+        timeout=httpx.Timeout(120.0, connect=5.0),
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=settings.services.http_max_connections,
+            max_keepalive_connections=settings.services.http_max_keepalive_connections,
+            keepalive_expiry=settings.services.http_keepalive_expiry,
+        ),
     )
+    stats_service.start()
     logger.info("Orchestrator is ready")
     yield
-    
+
+    await stats_service.stop()
     if state.http_client:
         await state.http_client.aclose()
     logger.info("Orchestrator stopped")
@@ -1,8 +1,10 @@
 import os
-import json
+import time
 import logging
+import orjson
+from collections import Counter, deque
 from typing import Dict, Any, Optional, List
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 from dataclasses import dataclass
 
 logger = logging.getLogger("orchestrator.audit")
@@ -23,38 +25,45 @@ class AuditEvent:
     user_id: Optional[str] = None
     error_message: Optional[str] = None
 
+    def __post_init__(self):
+        # Время события в секундах эпохи: фильтры по времени сравнивают числа,
+        # а не разбирают ISO-строку на каждом проходе. Это не поле dataclass,
+        # поэтому в ответы API и в лог оно не попадает
+        self.epoch = datetime.fromisoformat(self.timestamp).timestamp()
+
 
 class SecurityAuditor:
     def __init__(self):
-        self._events: List[AuditEvent] = []
         self._max_events = int(os.environ.get("AUDIT_MAX_EVENTS", "10000"))
+        # Кольцевой буфер: старые события вытесняются при добавлении за O(1)
+        self._events: deque[AuditEvent] = deque(maxlen=self._max_events)
+        # Каталог лога создается при первой записи, а не при импорте
         self._log_file = os.environ.get("AUDIT_LOG_FILE", "/app/logs/audit.log")
-        os.makedirs(os.path.dirname(self._log_file), exist_ok=True)
 
     def log_event(self, event: AuditEvent):
         """Логирует событие аудита."""
         self._events.append(event)
 
-        # Ограничиваем количество событий в памяти
-        if len(self._events) > self._max_events:
-            self._events = self._events[-self._max_events :]
-
         # Записываем в лог-файл
         try:
-            log_entry = json.dumps(event.__dict__, ensure_ascii=False)
-            with open(self._log_file, "a", encoding="utf-8") as f:
-                f.write(log_entry + "\n")
+            log_dir = os.path.dirname(self._log_file)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            with open(self._log_file, "ab") as f:
+                f.write(self._format_event(event))
         except Exception as e:
             logger.error(f"Failed to write audit log: {e}")
 
+    @staticmethod
+    def _format_event(event: AuditEvent) -> bytes:
+        """Строка лога: JSON события в UTF-8 с переводом строки."""
+        data = {k: v for k, v in event.__dict__.items() if k != "epoch"}
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+
     def get_events_by_timeframe(self, hours: int = 24) -> List[AuditEvent]:
         """Возвращает события за последние N часов."""
-        cutoff_time = datetime.now(timezone.utc) - timedelta(hours=hours)
-        return [
-            event
-            for event in self._events
-            if datetime.fromisoformat(event.timestamp) >= cutoff_time
-        ]
+        cutoff = time.time() - hours * 3600
+        return [event for event in self._events if event.epoch >= cutoff]
 
     def get_failed_requests(self, hours: int = 24) -> List[AuditEvent]:
         """Возвращает неудачные запросы за последние N часов."""
@@ -70,9 +79,7 @@ class SecurityAuditor:
         suspicious = []
 
         # Много запросов от одного IP
-        ip_requests: Dict[str, int] = {}
-        for event in events:
-            ip_requests[event.client_ip] = ip_requests.get(event.client_ip, 0) + 1
+        ip_requests = Counter(event.client_ip for event in events)
 
         threshold = int(os.environ.get("SUSPICIOUS_REQUEST_THRESHOLD", "100"))
         for ip, count in ip_requests.items():
@@ -106,12 +113,11 @@ class SecurityAuditor:
 
     def cleanup_old_events(self, days: int = 30):
         """Очищает старые события."""
-        cutoff_time = datetime.now(timezone.utc) - timedelta(days=days)
-        self._events = [
-            event
-            for event in self._events
-            if datetime.fromisoformat(event.timestamp) >= cutoff_time
-        ]
+        cutoff = time.time() - days * 86400
+        self._events = deque(
+            (event for event in self._events if event.epoch >= cutoff),
+            maxlen=self._max_events,
+        )
         logger.info(f"Cleaned up events older than {days} days")
 
 
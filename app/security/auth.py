@@ -1,5 +1,6 @@
 import os
 import time
+import asyncio
 import hashlib
 import secrets
 import logging
@@ -23,6 +24,12 @@ class AuthManager:
         self._failed_attempts: Dict[str, list] = {}
         self._max_attempts = int(os.environ.get("MAX_LOGIN_ATTEMPTS", "5"))
         self._lockout_duration = int(os.environ.get("LOCKOUT_DURATION_MINUTES", "15"))
+        # Кэш проверенных токенов: blake2b(token) -> (payload, monotonic-время истечения).
+        # Админка опрашивается постоянно одним и тем же токеном;
+        # по дайджесту в памяти не остаются сами токены
+        self._token_cache: Dict[bytes, tuple] = {}
+        self._token_cache_ttl = 60
+        self._token_cache_size = 4096
 
     def _get_or_create_secret_key(self) -> str:
         """Получает или создаёт секретный ключ для JWT."""
@@ -82,10 +89,17 @@ class AuthManager:
         return encoded_jwt
 
     def verify_token(self, token: str) -> Dict[str, Any]:
-        """Проверяет JWT токен."""
+        """Проверяет JWT токен. Результат успешной проверки кэшируется."""
+        cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        cached = self._token_cache.get(cache_key)
+        if cached is not None:
+            payload, expires_at = cached
+            if time.monotonic() < expires_at:
+                return payload
+            del self._token_cache[cache_key]
+
         try:
             payload = jwt.decode(token, self._secret_key, algorithms=[self._algorithm])
-            return payload
         except ExpiredSignatureError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired"
@@ -95,6 +109,18 @@ class AuthManager:
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
             )
 
+        # Не держим токен в кэше дольше его собственного срока жизни
+        ttl = self._token_cache_ttl
+        exp = payload.get("exp")
+        if isinstance(exp, (int, float)):
+            ttl = min(ttl, exp - time.time())
+        if ttl > 0:
+            if len(self._token_cache) >= self._token_cache_size:
+                # Вытесняем самую старую запись (dict сохраняет порядок вставки)
+                del self._token_cache[next(iter(self._token_cache))]
+            self._token_cache[cache_key] = (payload, time.monotonic() + ttl)
+        return payload
+
     def is_account_locked(self, identifier: str) -> bool:
         """Проверяет, заблокирован ли аккаунт."""
         if identifier not in self._failed_attempts:
@@ -111,15 +137,14 @@ class AuthManager:
 
         return False
 
-    def record_failed_attempt(self, identifier: str):
+    def record_failed_attempt(self, identifier: str, warn: bool = True):
         """Записывает неудачную попытку входа."""
         if identifier not in self._failed_attempts:
             self._failed_attempts[identifier] = []
 
         self._failed_attempts[identifier].append(time.time())
-        logger.warning(
-            f"Failed login attempt for {identifier}. Total: {len(self._failed_attempts[identifier])}"
-        )
+        if warn:
+            self._warn_failed_attempt(identifier)
 
         # Удаляем старые попытки
         cutoff_time = time.time() - self._lockout_duration * 60
@@ -129,6 +154,11 @@ class AuthManager:
             if attempt > cutoff_time
         ]
 
+    def _warn_failed_attempt(self, identifier: str):
+        logger.warning(
+            f"Failed login attempt for {identifier}. Total: {len(self._failed_attempts.get(identifier, ()))}"
+        )
+
     def clear_failed_attempts(self, identifier: str):
         """Очищает неудачные попытки входа."""
         if identifier in self._failed_attempts:
@@ -145,7 +175,7 @@ class AuthManager:
 
         return username, password_hash
 
-    def authenticate_admin(
+    async def authenticate_admin(
         self, username: str, password: str, client_ip: str
     ) -> Optional[str]:
         """Аутентифицирует администратора."""
@@ -171,8 +201,13 @@ class AuthManager:
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
             )
 
-        if not self.verify_password(password, password_hash):
-            self.record_failed_attempt(f"{username}@{client_ip}")
+        # Попытка засчитывается до проверки пароля: PBKDF2 (100k итераций)
+        # уходит в поток, и параллельные запросы иначе проходили бы проверку
+        # блокировки, пока ни один из них еще не записал неудачу.
+        # Счетчик трогается только в event loop, поэтому гонки нет
+        self.record_failed_attempt(f"{username}@{client_ip}", warn=False)
+        if not await asyncio.to_thread(self.verify_password, password, password_hash):
+            self._warn_failed_attempt(f"{username}@{client_ip}")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
             )
@@ -1,18 +1,35 @@
 import time
 import asyncio
+import contextlib
 import logging
 from typing import Dict, Optional
+import orjson
 import redis.asyncio as redis
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
 class RedisStatsService:
+    # Порядок метрик ключа в ответе MGET
+    _KEY_METRICS = ("total", "errors", "latency_sum")
+    # Общий для всех воркеров кэш готовых агрегатов
+    _STATS_CACHE_KEY = "cache:stats"
+    # Параметры фоновой пакетной записи
+    _QUEUE_SIZE = 50_000
+    _BATCH_SIZE = 500
+    _FLUSH_INTERVAL = 0.05
+
     def __init__(self):
         # Инициализируем соединение с Redis
         # decode_responses=True позволяет получать строки вместо байтов
         self.redis = redis.from_url(settings.services.redis_url, decode_responses=True)
         self.start_time = time.time()
+        # (monotonic-время сбора, агрегаты) последнего обращения к Redis
+        self._stats_cache: Optional[tuple[float, dict]] = None
+        # Очередь создается в start(), внутри работающего event loop
+        self._queue: Optional[asyncio.Queue] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._dropped = 0
 
     async def record_request(
         self, 
@@ -23,97 +40,206 @@ class RedisStatsService:
         latency: float
     ):
         """
-        Записывает статистику запроса в Redis.
-        Использует pipeline для атомарности и скорости (один сетевой запрос вместо пяти).
+        Записывает статистику одного запроса в Redis сразу, минуя очередь.
+        """
+        await self._write_batch([(provider, model, key_id, status_code, latency)])
+
+    def enqueue(
+        self,
+        provider: str,
+        model: str,
+        key_id: str,
+        status_code: int,
+        latency: float
+    ) -> None:
+        """
+        Ставит запись в очередь фоновой пакетной записи и сразу возвращается.
+        Если сервис не запущен или очередь переполнена, запись отбрасывается:
+        статистика не должна тормозить проксирование.
+        """
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait((provider, model, key_id, status_code, latency))
+        except asyncio.QueueFull:
+            self._dropped += 1
+
+    def start(self):
+        """Запускает фоновую запись очереди. Вызывается из lifespan."""
+        if self._flusher is None:
+            self._queue = asyncio.Queue(maxsize=self._QUEUE_SIZE)
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Останавливает фоновую запись, дописав то, что осталось в очереди."""
+        if self._flusher is None:
+            return
+        self._flusher.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._flusher
+        self._flusher = None
+
+        # Дописываем то, что осталось в очереди после остановки цикла
+        queue, self._queue = self._queue, None
+        rest = []
+        while not queue.empty():
+            rest.append(queue.get_nowait())
+        if rest:
+            await self._write_batch(rest)
+
+    async def _flush_loop(self):
+        """
+        Забирает записи из очереди пачками: до _BATCH_SIZE штук или
+        _FLUSH_INTERVAL секунд после первой записи, и пишет пачку одним pipeline.
+        """
+        queue = self._queue
+        batch = []
+        try:
+            while True:
+                batch.append(await queue.get())
+                with contextlib.suppress(TimeoutError):
+                    async with asyncio.timeout(self._FLUSH_INTERVAL):
+                        while len(batch) < self._BATCH_SIZE:
+                            batch.append(await queue.get())
+
+                pending, batch = batch, []
+                await self._write_batch(pending)
+
+                if self._dropped:
+                    logger.warning(f"Stats queue overflow: dropped {self._dropped} records")
+                    self._dropped = 0
+        finally:
+            # Пачка, собранная до остановки, в очередь уже не вернется
+            if batch:
+                await self._write_batch(batch)
+
+    async def _write_batch(self, records: list[tuple]):
+        """
+        Записывает пачку запросов в Redis.
+        Использует один pipeline на всю пачку (один сетевой запрос вместо пяти на запись).
         """
         try:
             async with self.redis.pipeline() as pipe:
-                # 1. Общие счетчики
-                pipe.incr("global:requests")
-                if status_code >= 400:
-                    pipe.incr("global:errors")
-                
-                # 2. Сохраняем идентификатор ключа в список известных ключей
-                # known_keys:gemini или known_keys:vertex
-                pipe.sadd(f"known_keys:{provider}", key_id)
-
-                # 3. Статистика по конкретному ключу
-                # stats:key:{key_id}:total -> +1
-                base_key = f"stats:key:{key_id}"
-                pipe.incr(f"{base_key}:total")
-                
-                # stats:key:{key_id}:{status_code} -> +1 (например, stats:key:xyz:200)
-                pipe.incr(f"{base_key}:{status_code}")
-                
-                if status_code >= 400:
-                    pipe.incr(f"{base_key}:errors")
-
-                # Опционально: можно хранить latency, но в Redis это сложнее.
-                # Пока пропустим для простоты, или можно хранить сумму и делить на total.
-                pipe.incrbyfloat(f"{base_key}:latency_sum", latency)
-                
+                for provider, model, key_id, status_code, latency in records:
+                    # 1. Общие счетчики
+                    pipe.incr("global:requests")
+                    if status_code >= 400:
+                        pipe.incr("global:errors")
+
+                    # 2. Сохраняем идентификатор ключа в список известных ключей
+                    # known_keys:gemini или known_keys:vertex
+                    pipe.sadd(f"known_keys:{provider}", key_id)
+
+                    # 3. Статистика по конкретному ключу
+                    # stats:key:{key_id}:total -> +1
+                    base_key = f"stats:key:{key_id}"
+                    pipe.incr(f"{base_key}:total")
+
+                    # stats:key:{key_id}:{status_code} -> +1 (например, stats:key:xyz:200)
+                    pipe.incr(f"{base_key}:{status_code}")
+
+                    if status_code >= 400:
+                        pipe.incr(f"{base_key}:errors")
+
+                    # Храним сумму задержек, среднее считается как сумма / total
+                    pipe.incrbyfloat(f"{base_key}:latency_sum", latency)
+
                 # Выполняем все команды разом
                 await pipe.execute()
-                
+
         except Exception as e:
             # Не роняем прод, если метрики не записались
             logger.error(f"Failed to record stats to Redis: {e}")
 
     async def get_stats(self) -> dict:
-        """Собирает полную статистику из Redis"""
+        """
+        Собирает полную статистику из Redis.
+        Агрегаты кэшируются на stats_cache_ttl секунд: дашборды опрашивают
+        /admin/stats постоянно, а цифры за пару секунд почти не меняются.
+        """
         try:
-            # Получаем общие данные
-            total_req = int(await self.redis.get("global:requests") or 0)
-            total_err = int(await self.redis.get("global:errors") or 0)
-            
-            # Получаем списки известных ключей
-            gemini_keys = await self.redis.smembers("known_keys:gemini")
-            vertex_projects = await self.redis.smembers("known_keys:vertex")
-            
-            all_keys_data = {}
-
-            # Собираем данные по каждому ключу Gemini
-            for key in gemini_keys:
-                all_keys_data[key] = await self._get_key_stats(key, "gemini")
-
-            # Собираем данные по каждому проекту Vertex
-            for proj in vertex_projects:
-                all_keys_data[proj] = await self._get_key_stats(proj, "vertex")
+            now = time.monotonic()
+            cached = self._stats_cache
+            if cached is not None and now - cached[0] < settings.services.stats_cache_ttl:
+                stats = cached[1]
+            else:
+                stats = await self._load_stats()
+                self._stats_cache = (now, stats)
 
             uptime = time.time() - self.start_time
-
-            return {
-                "uptime_seconds": round(uptime, 2),
-                "total_requests": total_req,
-                "total_errors": total_err,
-                "error_rate": round((total_err / total_req * 100), 2) if total_req > 0 else 0,
-                "keys_usage": all_keys_data
-            }
+            return {"uptime_seconds": round(uptime, 2), **stats}
         except Exception as e:
             logger.error(f"Failed to get stats from Redis: {e}")
             return {"error": str(e)}
 
-    async def _get_key_stats(self, key_id: str, provider: str) -> dict:
-        """Вспомогательный метод для чтения статистики по одному ключу"""
-        base_key = f"stats:key:{key_id}"
-        
-        # Запрашиваем основные метрики
-        total = int(await self.redis.get(f"{base_key}:total") or 0)
-        errors = int(await self.redis.get(f"{base_key}:errors") or 0)
-        latency_sum = float(await self.redis.get(f"{base_key}:latency_sum") or 0.0)
-        
-        # Получаем разбивку по кодам ответов
-        # Ищем ключи вида stats:key:{key_id}:200, stats:key:{key_id}:429...
-        # В продакшене лучше использовать HASH (hgetall), но для наглядности так
-        # Чтобы не сканировать весь Redis, просто вернем основные.
-        # Если нужна детализация по кодам, лучше использовать Redis Hash для каждого ключа.
-        
+    async def _load_stats(self) -> dict:
+        """
+        Берет агрегаты из общего кэша в Redis, а при промахе считает их
+        и кладет обратно, чтобы остальные воркеры uvicorn их переиспользовали.
+        """
+        cached = await self.redis.get(self._STATS_CACHE_KEY)
+        if cached is not None:
+            return orjson.loads(cached)
+
+        stats = await self._collect_stats()
+        await self.redis.set(
+            self._STATS_CACHE_KEY,
+            orjson.dumps(stats),
+            px=max(1, int(settings.services.stats_cache_ttl * 1000)),
+        )
+        return stats
+
+    async def _collect_stats(self) -> dict:
+        """Читает агрегаты из Redis без учета кэша"""
+        # Общие счетчики одним MGET вместо двух GET
+        total_req, total_err = await self.redis.mget(
+            "global:requests", "global:errors"
+        )
+        total_req = int(total_req or 0)
+        total_err = int(total_err or 0)
+
+        # Получаем списки известных ключей
+        gemini_keys = await self.redis.smembers("known_keys:gemini")
+        vertex_projects = await self.redis.smembers("known_keys:vertex")
+
+        owners = [(key, "gemini") for key in gemini_keys]
+        owners += [(proj, "vertex") for proj in vertex_projects]
+
+        # Метрики всех ключей читаем одним MGET, а не 3 запросами на ключ
+        all_keys_data = {}
+        if owners:
+            values = await self.redis.mget(
+                [
+                    f"stats:key:{key_id}:{metric}"
+                    for key_id, _ in owners
+                    for metric in self._KEY_METRICS
+                ]
+            )
+            for i, (key_id, provider) in enumerate(owners):
+                total, errors, latency_sum = values[i * 3 : i * 3 + 3]
+                all_keys_data[key_id] = self._build_key_stats(
+                    provider, total, errors, latency_sum
+                )
+
+        return {
+            "total_requests": total_req,
+            "total_errors": total_err,
+            "error_rate": round((total_err / total_req * 100), 2) if total_req > 0 else 0,
+            "keys_usage": all_keys_data
+        }
+
+    @staticmethod
+    def _build_key_stats(provider: str, total, errors, latency_sum) -> dict:
+        """Собирает статистику одного ключа из сырых значений Redis"""
+        total = int(total or 0)
+        errors = int(errors or 0)
+        latency_sum = float(latency_sum or 0.0)
+
         return {
             "provider": provider,
             "total_requests": total,
             "total_errors": errors,
             "avg_latency": round(latency_sum / total, 4) if total > 0 else 0,
-            # Можно допилить получение кодов
         }
 
 # Создаем глобальный инстанс
@@ -41,4 +41,14 @@ def mock_env(monkeypatch, tmp_path):
     
     # Restore .env file
     if renamed_env:
-        Path(".env.test_backup").rename(".env")
\ No newline at end of file
+        Path(".env.test_backup").rename(".env")
+
+@pytest.fixture(autouse=True)
+def audit_log_file(monkeypatch, tmp_path):
+    """Keeps the audit log of the app-wide auditor out of /app/logs."""
+    from app.security.audit import security_auditor
+
+    log_file = tmp_path / "logs" / "audit.log"
+    monkeypatch.setenv("AUDIT_LOG_FILE", str(log_file))
+    monkeypatch.setattr(security_auditor, "_log_file", str(log_file))
+    return log_file
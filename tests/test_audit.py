@@ -0,0 +1,90 @@
+import json
+import pytest
+from app.security.audit import AuditEvent, SecurityAuditor
+
+
+def make_event(
+    ip: str = "1.2.3.4",
+    status_code: int = 200,
+    timestamp: str = "2025-01-01T00:00:00+00:00",
+) -> AuditEvent:
+    return AuditEvent(
+        timestamp=timestamp,
+        event_type="request",
+        client_ip=ip,
+        user_agent="pytest",
+        endpoint="/v1beta/models/gemini-pro",
+        method="POST",
+        status_code=status_code,
+        response_time=0.1,
+        request_size=10,
+        response_size=20,
+    )
+
+
+@pytest.fixture
+def auditor(monkeypatch, tmp_path):
+    monkeypatch.setenv("AUDIT_LOG_FILE", str(tmp_path / "logs" / "audit.log"))
+    return SecurityAuditor()
+
+
+def test_log_event_writes_line(auditor, tmp_path):
+    # Каталог лога создается при первой записи
+    assert not (tmp_path / "logs").exists()
+    for ip in ["1.1.1.1", "2.2.2.2"]:
+        auditor.log_event(make_event(ip))
+
+    lines = (tmp_path / "logs" / "audit.log").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["client_ip"] for line in lines] == ["1.1.1.1", "2.2.2.2"]
+
+
+def test_events_bounded(monkeypatch, tmp_path):
+    monkeypatch.setenv("AUDIT_LOG_FILE", str(tmp_path / "logs" / "audit.log"))
+    monkeypatch.setenv("AUDIT_MAX_EVENTS", "3")
+    auditor = SecurityAuditor()
+    for i in range(5):
+        auditor.log_event(make_event(f"10.0.0.{i}"))
+
+    # В памяти остаются только последние события
+    assert [e.client_ip for e in auditor._events] == ["10.0.0.2", "10.0.0.3", "10.0.0.4"]
+
+
+def test_timeframe_filters(auditor, monkeypatch):
+    from datetime import datetime, timezone
+
+    recent = make_event("5.5.5.5", timestamp=datetime.now(timezone.utc).isoformat())
+    auditor.log_event(recent)
+    auditor.log_event(make_event("6.6.6.6", status_code=500))  # 2025, давно
+
+    assert auditor.get_events_by_timeframe(hours=1) == [recent]
+    assert auditor.get_failed_requests(hours=1) == []
+
+    monkeypatch.setenv("SUSPICIOUS_REQUEST_THRESHOLD", "0")
+    assert auditor.get_suspicious_activity(hours=1) == [
+        {"type": "high_frequency_requests", "ip": "5.5.5.5", "count": 1, "threshold": 0}
+    ]
+
+    auditor.cleanup_old_events(days=1)
+    assert list(auditor._events) == [recent]
+
+
+def test_epoch_not_serialized(auditor, tmp_path):
+    """The helper epoch stays out of the log line and the dataclass fields."""
+    from dataclasses import asdict
+
+    auditor.log_event(make_event())
+
+    line = (tmp_path / "logs" / "audit.log").read_text(encoding="utf-8")
+    assert "epoch" not in json.loads(line)
+    assert "epoch" not in asdict(make_event())
+
+
+def test_unwritable_log_dir(monkeypatch, tmp_path):
+    """A log path that can't be created doesn't break the auditor."""
+    blocker = tmp_path / "not-a-dir"
+    blocker.write_text("")
+    monkeypatch.setenv("AUDIT_LOG_FILE", str(blocker / "audit.log"))
+    auditor = SecurityAuditor()
+
+    auditor.log_event(make_event("9.9.9.9"))
+    assert len(auditor._events) == 1
@@ -55,3 +55,15 @@ def test_ensure_directories(mock_env):
     # Check content of gemini keys file
     with open(settings.paths.gemini_keys_file, "r") as f:
         assert f.read() == "[]"
+
+def test_ensure_directories_idempotent(mock_env):
+    """Running ensure_directories twice keeps existing dirs and files intact."""
+    get_settings.cache_clear()
+    settings = get_settings()
+
+    ensure_directories()
+    settings.paths.gemini_keys_file.write_text('["key"]')
+    ensure_directories()
+
+    assert settings.paths.vertex_creds_dir.is_dir()
+    assert settings.paths.gemini_keys_file.read_text() == '["key"]'
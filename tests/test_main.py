@@ -1,3 +1,4 @@
+import jwt
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, patch
@@ -102,3 +103,69 @@ def test_admin_reload(client, admin_auth):
         assert response.status_code == 200
         assert mock_vertex.reload.called
         assert mock_gemini.reload.called
+
+def test_ip_allowlist(monkeypatch):
+    """Unlisted IPs get 403 on everything the proxy route serves, including
+    admin- and docs-looking paths that no real route matched."""
+    from app.config import SecuritySettings, settings
+
+    monkeypatch.setattr(
+        settings, "security", SecuritySettings(allowed_client_ips=["10.0.0.1"])
+    )
+
+    c = TestClient(app, client=("10.0.0.2", 123))
+    for path in (
+        "/v1beta/models/gemini-pro",
+        "/admin/%2e%2e/v1beta/models/gemini-pro",
+        "/admin/anything",
+        "/docs",
+    ):
+        response = c.get(path)
+        assert response.status_code == 403, path
+        assert "not whitelisted" in response.json()["detail"]
+    # Настоящие роуты админки закрыты JWT, а не белым списком
+    assert c.get("/admin/status").status_code == 401
+
+    c = TestClient(app, client=("10.0.0.1", 123))
+    # IP разрешен; клиент апстрима без lifespan не создан
+    assert c.get("/v1beta/models/gemini-pro").status_code == 503
+
+def test_verify_token_cached():
+    """A verified token is not decoded again while it stays in the cache."""
+    token = auth_manager.create_access_token({"sub": "admin", "role": "admin"})
+    with patch("app.security.auth.jwt.decode", wraps=jwt.decode) as mock_decode:
+        first = auth_manager.verify_token(token)
+        second = auth_manager.verify_token(token)
+
+    assert first == second
+    assert first["sub"] == "admin"
+    assert mock_decode.call_count == 1
+
+def test_http_client_honours_env_proxy(mock_env, monkeypatch):
+    """The upstream client keeps HTTP(S)_PROXY support from the environment."""
+    from app.core import state
+
+    monkeypatch.setenv("HTTPS_PROXY", "http://proxy.local:3128")
+    get_settings.cache_clear()
+    with patch("app.services.statistics.redis.from_url"):
+        with TestClient(app):
+            assert state.http_client._mounts
+
+def test_concurrent_failed_logins_respect_lockout(admin_auth):
+    """Parallel wrong-password logins cannot exceed the attempt limit."""
+    import asyncio
+    from fastapi import HTTPException
+
+    async def attempt():
+        try:
+            await auth_manager.authenticate_admin("admin", "wrong", "10.9.9.9")
+        except HTTPException as e:
+            return e.status_code
+
+    async def run():
+        return await asyncio.gather(*(attempt() for _ in range(10)))
+
+    codes = asyncio.run(run())
+    auth_manager.clear_failed_attempts("admin@10.9.9.9")
+    assert codes.count(401) == auth_manager._max_attempts
+    assert codes.count(423) == 10 - auth_manager._max_attempts
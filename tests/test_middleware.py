@@ -0,0 +1,25 @@
+def test_stats_middleware_records_status(monkeypatch):
+    """The response status is taken from the ASGI start message."""
+    from fastapi import FastAPI, Response
+    from fastapi.testclient import TestClient
+    from app.core.middleware import StatsMiddleware
+    from app.services.statistics import stats_service
+
+    records = []
+    monkeypatch.setattr(stats_service, "enqueue", lambda *args: records.append(args))
+
+    app = FastAPI()
+
+    @app.get("/{path:path}")
+    async def upstream(path: str):
+        return Response(status_code=429)
+
+    app.add_middleware(StatsMiddleware)
+
+    with TestClient(app) as client:
+        client.get("/v1beta/models/gemini-pro:generateContent")
+        client.get("/admin/status")
+
+    assert len(records) == 1
+    provider, model, key_id, status_code, _ = records[0]
+    assert (provider, model, status_code) == ("gemini", "gemini-pro", 429)
@@ -0,0 +1,142 @@
+import asyncio
+import httpx
+from app.api.proxy import (
+    _STRIP_RESPONSE_HEADERS,
+    _clean_upstream_headers,
+    _extract_model,
+    _rewrite_project,
+)
+
+
+def test_rewrite_project_replaces_project_id():
+    """Project ID in a Vertex path is replaced with the credential's one."""
+    path = "v1/projects/fake/locations/us-central1/publishers/google/models/imagen-3:predict"
+    assert _rewrite_project(path, "real") == (
+        "v1/projects/real/locations/us-central1/publishers/google/models/imagen-3:predict"
+    )
+    assert _rewrite_project(
+        "v1beta1/projects/fake/locations/global", "real"
+    ) == "v1beta1/projects/real/locations/global"
+
+
+def test_rewrite_project_leaves_other_paths():
+    """Paths that don't match the Vertex layout are returned unchanged."""
+    for path in [
+        "v1beta/models/gemini-pro:generateContent",
+        "v2/projects/fake/locations/us-central1",
+        "v1beta/projects/fake/locations/us-central1",
+        "v1/projects/fake/operations/123",
+        "v1/projects//locations/us-central1",
+    ]:
+        assert _rewrite_project(path, "real") == path
+
+
+def test_extract_model():
+    """Model is taken from the segment after 'models'."""
+    assert _extract_model("v1beta/models/gemini-pro:generateContent", True) == "gemini-pro"
+    assert _extract_model(
+        "v1/projects/p/locations/l/publishers/google/models/imagen-3", False
+    ) == "imagen-3"
+    assert _extract_model("models/gemini-pro:countTokens", True) == "gemini-pro"
+    assert _extract_model("v1beta/tunedmodels/x", True) == "unknown"
+    assert _extract_model("v1beta/models", True) == "unknown"
+    assert _extract_model("v1beta/files", True) == "unknown"
+
+
+def test_clean_upstream_headers():
+    """Stripped headers are dropped, repeated headers are kept."""
+    headers = httpx.Headers([
+        ("Content-Type", "application/json"),
+        ("Content-Encoding", "gzip"),
+        ("Set-Cookie", "a=1"),
+        ("Set-Cookie", "b=2"),
+    ])
+    assert _clean_upstream_headers(headers, _STRIP_RESPONSE_HEADERS) == [
+        (b"content-type", b"application/json"),
+        (b"set-cookie", b"a=1"),
+        (b"set-cookie", b"b=2"),
+    ]
+
+
+def test_empty_vertex_pool_is_not_retried(monkeypatch):
+    """An empty credential pool fails fast instead of burning every retry."""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.core import state
+    from app.services.statistics import stats_service
+
+    client = httpx.AsyncClient()
+    monkeypatch.setattr(state.vertex_rotator, "_pool", [])
+    monkeypatch.setattr(state, "http_client", client)
+    monkeypatch.setattr(stats_service, "enqueue", lambda **kwargs: None)
+    spy = []
+    original = state.vertex_rotator.get_next_credential
+
+    def counted():
+        spy.append(1)
+        return original()
+
+    monkeypatch.setattr(state.vertex_rotator, "get_next_credential", counted)
+
+    # Адрес из белого списка: тест не зависит от SECURITY__ALLOWED_CLIENT_IPS
+    try:
+        response = TestClient(app, client=("127.0.0.1", 1)).post(
+            "/v1/projects/p/locations/l/publishers/google/models/m:predict"
+        )
+    finally:
+        asyncio.run(client.aclose())
+    assert response.status_code == 503
+    assert response.text == "No Vertex credentials available"
+    assert len(spy) == 1
+
+
+def _proxy_with_upstream(monkeypatch, statuses):
+    """Runs the proxy against a mock upstream answering with the given statuses."""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.core import state
+    from app.services.statistics import stats_service
+
+    received = []
+
+    async def handler(request):
+        received.append(await request.aread())
+        status = statuses[len(received) - 1]
+        return httpx.Response(status, stream=httpx.ByteStream(b'{"ok": true}'))
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(state, "http_client", client)
+    monkeypatch.setattr(state.gemini_rotator, "get_next_key", lambda: "test-key")
+    monkeypatch.setattr(stats_service, "enqueue", lambda **kwargs: None)
+    test_client = TestClient(app, client=("127.0.0.1", 1))
+    return test_client, client, received
+
+
+def test_retry_replays_request_body(monkeypatch):
+    """After a 429 the next attempt sends the same request body again."""
+    test_client, client, received = _proxy_with_upstream(monkeypatch, [429, 200])
+    body = b'{"contents": [{"parts": [{"text": "hi"}]}]}' * 100
+    try:
+        response = test_client.post(
+            "/v1beta/models/gemini-pro:generateContent", content=body
+        )
+    finally:
+        asyncio.run(client.aclose())
+    assert response.status_code == 200
+    assert received == [body, body]
+
+
+def test_body_over_replay_limit_is_not_retried(monkeypatch):
+    """A body larger than the replay buffer is not kept and not retried."""
+    import app.api.proxy as proxy
+
+    monkeypatch.setattr(proxy, "_REPLAY_BUFFER_LIMIT", 16)
+    test_client, client, received = _proxy_with_upstream(monkeypatch, [429, 200])
+    try:
+        response = test_client.post(
+            "/v1beta/models/gemini-pro:generateContent", content=b"x" * 64
+        )
+    finally:
+        asyncio.run(client.aclose())
+    assert response.status_code == 429
+    assert received == [b"x" * 64]
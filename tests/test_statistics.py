@@ -67,8 +67,15 @@ async def test_get_stats(stats_service, mock_redis_client):
             "stats:key:p1:latency_sum": "20.0"
         }
         return data.get(key)
-    
+
+    async def mock_mget(*keys):
+        # MGET принимает и список ключей, и ключи позиционно
+        if len(keys) == 1 and isinstance(keys[0], list):
+            keys = keys[0]
+        return [await mock_get(key) for key in keys]
+
     mock_redis_client.get.side_effect = mock_get
+    mock_redis_client.mget.side_effect = mock_mget
     
     async def mock_smembers(key):
         data = {
@@ -86,3 +93,46 @@ async def test_get_stats(stats_service, mock_redis_client):
     assert "k1" in stats["keys_usage"]
     assert stats["keys_usage"]["k1"]["total_requests"] == 50
     assert stats["keys_usage"]["k1"]["avg_latency"] == 0.2
+
+@pytest.mark.asyncio
+async def test_get_stats_uses_cache(stats_service, mock_redis_client):
+    mock_redis_client.get.return_value = None
+    mock_redis_client.mget.return_value = ["10", "1"]
+    mock_redis_client.smembers.return_value = set()
+
+    first = await stats_service.get_stats()
+    second = await stats_service.get_stats()
+
+    # Повторный вызов в пределах TTL не должен ходить в Redis
+    assert mock_redis_client.mget.call_count == 1
+    assert first["total_requests"] == second["total_requests"] == 10
+
+@pytest.mark.asyncio
+async def test_get_stats_shared_cache(stats_service, mock_redis_client):
+    # Агрегаты, уже посчитанные другим воркером
+    mock_redis_client.get.return_value = '{"total_requests": 7, "keys_usage": {}}'
+
+    stats = await stats_service.get_stats()
+
+    assert stats["total_requests"] == 7
+    mock_redis_client.mget.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_enqueue_flushes_batch(stats_service, mock_redis_client):
+    mock_pipeline = AsyncMock()
+    mock_pipeline.__aenter__.return_value = mock_pipeline
+    mock_redis_client.pipeline.return_value = mock_pipeline
+
+    stats_service.start()
+    for i in range(3):
+        stats_service.enqueue("gemini", "gemini-pro", f"key-{i}", 200, 0.1)
+    await stats_service.stop()
+
+    # Все записи уходят в Redis одним pipeline
+    mock_pipeline.execute.assert_called_once()
+    assert mock_pipeline.sadd.call_count == 3
+
+def test_enqueue_before_start_is_dropped(stats_service, mock_redis_client):
+    # Без запущенного сервиса запись молча отбрасывается
+    stats_service.enqueue("gemini", "gemini-pro", "key", 200, 0.1)
+    mock_redis_client.pipeline.assert_not_called()